@@ -6,7 +6,7 @@ from .rsp_amplitude import rsp_amplitude
 from .rsp_analyze import rsp_analyze
 from .rsp_clean import rsp_clean
 from .rsp_eventrelated import rsp_eventrelated
-from .rsp_findpeaks import rsp_findpeaks
+from .rsp_findpeaks import rsp_findpeaks, rsp_findpeaks_batch
 from .rsp_fixpeaks import rsp_fixpeaks
 from .rsp_intervalrelated import rsp_intervalrelated
 from .rsp_methods import rsp_methods
@@ -25,6 +25,7 @@ __all__ = [
     "rsp_simulate",
     "rsp_clean",
     "rsp_findpeaks",
+    "rsp_findpeaks_batch",
     "rsp_fixpeaks",
     "rsp_peaks",
     "rsp_phase",
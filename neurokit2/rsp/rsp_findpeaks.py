@@ -1,9 +1,22 @@
 # -*- coding: utf-8 -*-
+import collections
+import copy
+import functools
+import hashlib
+import threading
+
 import numpy as np
 import pandas as pd
-import scipy.signal
 from signal_processing.utils import detect_peaks_troughs
 
+# Results of the most recent calls made with cache=True, keyed by signal content and parameters.
+# Signals longer than _RSP_FINDPEAKS_CACHE_MAXLEN are not cached, as hashing them would cost too
+# much.
+_RSP_FINDPEAKS_CACHE = collections.OrderedDict()
+_RSP_FINDPEAKS_CACHE_LOCK = threading.Lock()
+_RSP_FINDPEAKS_CACHE_SIZE = 32
+_RSP_FINDPEAKS_CACHE_MAXLEN = 10_000_000
+
 
 def rsp_findpeaks(
     rsp_cleaned,
@@ -13,7 +26,8 @@ def rsp_findpeaks(
     peak_distance=0.8,
     peak_prominence=0.5,
     delta=0,
-    lookahead=200
+    lookahead=200,
+    cache=False,
 ):
     """**Extract extrema in a respiration (RSP) signal**
 
@@ -41,6 +55,11 @@ def rsp_findpeaks(
         seconds.
     peak_prominence: float
         Only applies if method is ``"scipy"``. Minimal prominence between peaks. Default is 0.5.
+    cache : bool
+        If ``True``, the result is stored and reused by subsequent calls on the same signal with
+        the same parameters (the 32 most recent results are kept). As the signal needs to be
+        hashed to be identified, this is only worth it when the same signal is processed
+        repeatedly (e.g., during parameter sweeps). Default is ``False``.
 
     Returns
     -------
@@ -70,39 +89,127 @@ def rsp_findpeaks(
     """
     # Try retrieving correct column
     if isinstance(rsp_cleaned, pd.DataFrame):
-        try:
-            rsp_cleaned = rsp_cleaned["RSP_Clean"]
-        except NameError:
-            try:
-                rsp_cleaned = rsp_cleaned["RSP_Raw"]
-            except NameError:
-                rsp_cleaned = rsp_cleaned["RSP"]
-
-    cleaned = np.array(rsp_cleaned)
-
-    # Find peaks
+        cols = ("RSP_Clean", "RSP_Raw", "RSP")
+        col = next((c for c in cols if c in rsp_cleaned.columns), None)
+        if col is None:
+            raise KeyError(
+                "NeuroKit error: rsp_findpeaks(): Wrong input, the DataFrame should contain"
+                " one of the 'RSP_Clean', 'RSP_Raw' or 'RSP' columns."
+            )
+        rsp_cleaned = rsp_cleaned[col].to_numpy()
+
+    cleaned = _rsp_findpeaks_asarray(rsp_cleaned)
     method = method.lower()  # remove capitalised letters
-    if method in ["khodadad", "khodadad2018"]:
-        info = _rsp_findpeaks_khodadad(cleaned, amplitude_min=amplitude_min)
-    elif method == "biosppy":
-        info = _rsp_findpeaks_biosppy(cleaned, sampling_rate=sampling_rate)
-    elif method in ["noto", "noto2018"]:
-        info = _rsp_findpeaks_noto(cleaned, delta=delta, lookahead=lookahead)
-    elif method == "scipy":
-        info = _rsp_findpeaks_scipy(
-            cleaned,
-            sampling_rate=sampling_rate,
-            peak_distance=peak_distance,
-            peak_prominence=peak_prominence,
-        )
-    else:
+    if method not in _RSP_FINDPEAKS_METHODS:
         raise ValueError(
-            "NeuroKit error: rsp_findpeaks(): 'method' should be one of 'khodadad2018', 'scipy' or 'biosppy'."
+            "NeuroKit error: rsp_findpeaks(): 'method' should be one of 'khodadad2018', 'scipy',"
+            " 'biosppy' or 'noto2018'."
         )
+    func, argnames = _RSP_FINDPEAKS_METHODS[method]
+
+    params = {
+        "sampling_rate": sampling_rate,
+        "amplitude_min": amplitude_min,
+        "peak_distance": peak_distance,
+        "peak_prominence": peak_prominence,
+        "delta": delta,
+        "lookahead": lookahead,
+    }
+    params = {arg: params[arg] for arg in argnames}
+
+    # Reuse the result of a previous call on the same signal with the same parameters
+    key = _rsp_findpeaks_cachekey(cleaned, func, *params.values()) if cache else None
+    if key is not None:
+        with _RSP_FINDPEAKS_CACHE_LOCK:
+            cached = _RSP_FINDPEAKS_CACHE.get(key)
+            if cached is not None:
+                _RSP_FINDPEAKS_CACHE.move_to_end(key)
+        if cached is not None:
+            return {k: copy.copy(v) for k, v in cached.items()}
+
+    # Find peaks
+    info = func(cleaned, **params)
+
+    if key is not None:
+        with _RSP_FINDPEAKS_CACHE_LOCK:
+            _RSP_FINDPEAKS_CACHE[key] = {k: copy.copy(v) for k, v in info.items()}
+            if len(_RSP_FINDPEAKS_CACHE) > _RSP_FINDPEAKS_CACHE_SIZE:
+                _RSP_FINDPEAKS_CACHE.popitem(last=False)
 
     return info
 
 
+def rsp_findpeaks_batch(rsp_cleaned, sampling_rate=1000, method="khodadad2018", **kwargs):
+    """**Extract extrema in multiple respiration (RSP) channels**
+
+    Applies :func:`.rsp_findpeaks` to each channel of a multichannel recording, such as
+    multi-lead respiratory inductance plethysmography (e.g., thoracic and abdominal bands). The
+    signals are converted once as a whole, so that each channel is processed without further
+    copies. Channels are processed one after the other; as :func:`.rsp_findpeaks` is thread-safe,
+    they can also be dispatched to a thread pool by the caller.
+
+    Parameters
+    ----------
+    rsp_cleaned : Union[np.array, pd.DataFrame]
+        The cleaned respiration channels, as a 2D array of shape (n_channels, n_samples), or as a
+        DataFrame with one channel per column (all columns should be numeric).
+    sampling_rate : int
+        The sampling frequency of :func:`.rsp_cleaned` (in Hz, i.e., samples/second).
+    method : str
+        The processing pipeline to apply. See :func:`.rsp_findpeaks`.
+    **kwargs
+        Other arguments passed to :func:`.rsp_findpeaks`.
+
+    Returns
+    -------
+    list
+        A list containing, for each channel, the dictionary returned by :func:`.rsp_findpeaks`.
+
+    See Also
+    --------
+    rsp_findpeaks, rsp_clean, rsp_peaks
+
+    Examples
+    --------
+    .. ipython:: python
+
+      import neurokit2 as nk
+      import numpy as np
+
+      rsp1 = nk.rsp_simulate(duration=30, respiratory_rate=15, random_state=1)
+      rsp2 = nk.rsp_simulate(duration=30, respiratory_rate=15, random_state=2)
+      cleaned = np.vstack([nk.rsp_clean(rsp1), nk.rsp_clean(rsp2)])
+      infos = nk.rsp_findpeaks_batch(cleaned)
+      [len(info["RSP_Peaks"]) for info in infos]
+
+    """
+    if isinstance(rsp_cleaned, pd.DataFrame):
+        non_numeric = rsp_cleaned.columns[
+            [not pd.api.types.is_numeric_dtype(dtype) for dtype in rsp_cleaned.dtypes]
+        ]
+        if len(non_numeric) > 0:
+            raise ValueError(
+                "NeuroKit error: rsp_findpeaks_batch(): all DataFrame columns should be"
+                f" respiration channels, but {list(non_numeric)} are not numeric."
+            )
+        rsp_cleaned = rsp_cleaned.to_numpy().T
+
+    signals = np.asarray(rsp_cleaned)
+    if signals.ndim == 1:
+        signals = signals[np.newaxis, :]
+    if signals.ndim != 2:
+        raise ValueError(
+            "NeuroKit error: rsp_findpeaks_batch(): 'rsp_cleaned' should be a 2D array of shape"
+            " (n_channels, n_samples)."
+        )
+    signals = _rsp_findpeaks_asarray(signals)
+
+    return [
+        rsp_findpeaks(signal, sampling_rate=sampling_rate, method=method, **kwargs)
+        for signal in signals
+    ]
+
+
 # =============================================================================
 # Methods
 # =============================================================================
@@ -145,11 +252,15 @@ def _rsp_findpeaks_noto(rsp_cleaned, delta=0, lookahead=200):
 
 def _rsp_findpeaks_scipy(rsp_cleaned, sampling_rate, peak_distance=0.8, peak_prominence=0.5):
     """https://docs.scipy.org/doc/scipy/reference/generated/scipy.signal.find_peaks.html"""
+    from scipy.signal import find_peaks
+
     peak_distance = sampling_rate * peak_distance
-    peaks, _ = scipy.signal.find_peaks(
+    peaks, _ = find_peaks(
         rsp_cleaned, distance=peak_distance, prominence=peak_prominence
     )
-    troughs, _ = scipy.signal.find_peaks(
+    # The sign-flipped copy is kept: the distance and prominence criteria of find_peaks() depend
+    # on the whole signal, so that troughs cannot be filtered on windows around each of them.
+    troughs, _ = find_peaks(
         -rsp_cleaned, distance=peak_distance, prominence=peak_prominence
     )
 
@@ -163,76 +274,216 @@ def _rsp_findpeaks_scipy(rsp_cleaned, sampling_rate, peak_distance=0.8, peak_pro
     return info
 
 
+# Methods by name, along with the parameters of rsp_findpeaks() they use
+_RSP_FINDPEAKS_METHODS = {
+    "khodadad": (_rsp_findpeaks_khodadad, ("amplitude_min",)),
+    "khodadad2018": (_rsp_findpeaks_khodadad, ("amplitude_min",)),
+    "biosppy": (_rsp_findpeaks_biosppy, ("sampling_rate",)),
+    "noto": (_rsp_findpeaks_noto, ("delta", "lookahead")),
+    "noto2018": (_rsp_findpeaks_noto, ("delta", "lookahead")),
+    "scipy": (_rsp_findpeaks_scipy, ("sampling_rate", "peak_distance", "peak_prominence")),
+}
+
+
 # =============================================================================
 # Internals
 # =============================================================================
 
 
+def _rsp_findpeaks_asarray(rsp_cleaned):
+    # Single-precision signals (e.g., from wearables) are processed as such, rather than being
+    # upcast to double precision.
+    cleaned = np.asarray(rsp_cleaned)
+    dtype = np.float32 if cleaned.dtype == np.float32 else np.float64
+    return np.ascontiguousarray(cleaned, dtype=dtype)
+
+
+def _rsp_findpeaks_cachekey(cleaned, *params):
+    # Identify the signal by a hash of its content (None if it cannot be cached)
+    if cleaned.size > _RSP_FINDPEAKS_CACHE_MAXLEN:
+        return None
+    key = (cleaned.dtype.str, cleaned.shape) + params
+    try:
+        hash(key)
+    except TypeError:  # e.g., array-like parameters
+        return None
+    digest = hashlib.blake2b(cleaned, digest_size=16).digest()
+    return (digest,) + key
+
+
 def _rsp_findpeaks_extrema(rsp_cleaned):
     # Detect zero crossings (note that these are zero crossings in the raw
     # signal, not in its gradient).
-    greater = rsp_cleaned > 0
-    smaller = rsp_cleaned < 0
-    risex = np.where(np.bitwise_and(smaller[:-1], greater[1:]))[0]
-    fallx = np.where(np.bitwise_and(greater[:-1], smaller[1:]))[0]
+    risex, fallx = _rsp_findpeaks_zerocrossings(rsp_cleaned)
 
-    if risex[0] < fallx[0]:
-        startx = "rise"
-    elif fallx[0] < risex[0]:
-        startx = "fall"
+    # Flat or DC-offset signals have no segments to search
+    if risex.size == 0 or fallx.size == 0:
+        return np.empty(0, dtype=np.intp)
 
-    allx = np.concatenate((risex, fallx))
-    allx.sort(kind="mergesort")
+    # Segments between zero crossings alternate between maxima and minima,
+    # starting with a maximum if the first zero crossing is rising.
+    start_is_rise = risex[0] < fallx[0]
+
+    # Rising and falling zero crossings strictly alternate, so that they can be
+    # merged by interleaving them.
+    first, second = (risex, fallx) if start_is_rise else (fallx, risex)
+    allx = np.empty(len(risex) + len(fallx), dtype=np.intp)
+    allx[0::2] = first
+    allx[1::2] = second
 
     # Find extrema by searching minima between falling zero crossing and
     # rising zero crossing, and searching maxima between rising zero
-    # crossing and falling zero crossing.
-    extrema = []
-    for i in range(len(allx) - 1):
+    # crossing and falling zero crossing. If numba is available, the segments
+    # are scanned in a single compiled loop. Otherwise, long segments (as in
+    # cleaned signals) are searched one by one, and short segments (as in
+    # noisy signals) all at once.
+    extrema_loop = _rsp_findpeaks_numba(_rsp_findpeaks_extrema_loop)
+    if extrema_loop is None:
+        if (len(allx) - 1) * 256 <= allx[-1] - allx[0]:
+            extrema_loop = _rsp_findpeaks_extrema_views
+        else:
+            extrema_loop = _rsp_findpeaks_extrema_reduceat
+    return extrema_loop(rsp_cleaned, allx, start_is_rise)
+
+
+def _rsp_findpeaks_extrema_views(rsp_cleaned, allx, start_is_rise):
+    # Search each segment as a view on the signal, so that no signal-length
+    # temporary is allocated.
+    want_max = ((np.arange(len(allx) - 1) & 1) == 0) == start_is_rise
+    extrema = np.empty(len(allx) - 1, dtype=np.intp)
+    for i, (beg, end) in enumerate(zip(allx[:-1], allx[1:])):
+        argextreme = np.argmax if want_max[i] else np.argmin
+        extrema[i] = beg + argextreme(rsp_cleaned[beg:end])
+    return extrema
+
+
+def _rsp_findpeaks_extrema_reduceat(rsp_cleaned, allx, start_is_rise):
+    # Minima are searched as maxima of the sign-flipped segments, so that all
+    # segments are reduced at once regardless of their parity.
+    segment_idx = np.arange(len(allx) - 1)
+    flip = ((segment_idx & 1) == 0) != start_is_rise
+
+    # Get the samples between the first and the last zero crossing, and the
+    # segment each of them belongs to.
+    segments = np.repeat(segment_idx, np.diff(allx))
+    values = rsp_cleaned[allx[0] : allx[-1]].copy()
+    values[flip[segments]] *= -1
+
+    # The extreme of each segment is its first sample reaching the segment's
+    # maximum. As for np.argmax(), this is the first NaN of segments
+    # containing any (the NaN being propagated to their maximum).
+    starts = allx[:-1] - allx[0]
+    maxima = np.maximum.reduceat(values, starts)
+    hits = values == maxima[segments]
+    if np.isnan(maxima).any():
+        hits |= np.isnan(values)
+    hits = np.flatnonzero(hits)
+    extrema = hits[np.searchsorted(hits, starts)] + allx[0]
+
+    return extrema
+
 
-        # Determine whether to search for minimum or maximum.
-        if startx == "rise":
-            if (i + 1) % 2 != 0:
-                argextreme = np.argmax
-            else:
-                argextreme = np.argmin
-        elif startx == "fall":
-            if (i + 1) % 2 != 0:
-                argextreme = np.argmin
-            else:
-                argextreme = np.argmax
-
-        # Get the two zero crossings between which the extreme will be
-        # searched.
-        beg = allx[i]
-        end = allx[i + 1]
-
-        extreme = argextreme(rsp_cleaned[beg:end])
-        extrema.append(beg + extreme)
-
-    extrema = np.asarray(extrema)
+def _rsp_findpeaks_extrema_loop(rsp_cleaned, allx, start_is_rise):
+    # Walk through each segment once, keeping track of its first maximum (or
+    # minimum). Segments alternate, starting with a maximum if the first zero
+    # crossing is rising. As for np.argmax(), the first NaN is returned for
+    # segments containing any.
+    extrema = np.empty(len(allx) - 1, dtype=np.intp)
+    for i in range(len(allx) - 1):
+        want_max = ((i & 1) == 0) == start_is_rise
+        best = allx[i]
+        if not np.isnan(rsp_cleaned[best]):
+            for j in range(allx[i] + 1, allx[i + 1]):
+                value = rsp_cleaned[j]
+                if np.isnan(value):
+                    best = j
+                    break
+                if want_max:
+                    if value > rsp_cleaned[best]:
+                        best = j
+                elif value < rsp_cleaned[best]:
+                    best = j
+        extrema[i] = best
     return extrema
 
 
+@functools.lru_cache(maxsize=None)
+def _rsp_findpeaks_numba(loop):
+    # Compile the given loop on first use (numba is an optional dependency).
+    try:
+        import numba
+    except ImportError:
+        return None
+    return numba.njit(cache=True)(loop)
+
+
+def _rsp_findpeaks_zerocrossings(rsp_cleaned):
+    # Pack the sign bits of the signal into 64-bit words (one sample per bit),
+    # so that all crossings can be found with a few bitwise operations per 64
+    # samples. Each word is compared with itself shifted by one sample, the
+    # missing bit being carried over from the previous word (the first sample
+    # is compared with itself).
+    n = len(rsp_cleaned)
+    bits = np.packbits(np.signbit(rsp_cleaned), bitorder="little")
+    bits = np.pad(bits, (0, -len(bits) % 8))
+    words = bits.view("<u8").astype(np.uint64, copy=False)
+
+    carry = np.empty_like(words)
+    carry[1:] = words[:-1] >> np.uint64(63)
+    carry[:1] = words[:1] & np.uint64(1)
+    crossings = words ^ ((words << np.uint64(1)) | carry)
+
+    # Crossings are sparse, so only the words containing at least one of them
+    # are unpacked. Crossings are indexed by the sample preceding them, and
+    # those caused by the zero padding of the last word are dropped.
+    nonzero = np.flatnonzero(crossings)
+    unpacked = np.unpackbits(
+        crossings[nonzero].astype("<u8").view(np.uint8), bitorder="little"
+    )
+    setbits = np.flatnonzero(unpacked)
+    crossx = nonzero[setbits >> 6] * 64 + (setbits & 63)
+    crossx = crossx[crossx < n]
+
+    # Rising crossings end on a non-negative sample, falling ones on a negative
+    # sample.
+    falling = np.signbit(rsp_cleaned[crossx])
+    risex = crossx[~falling] - 1
+    fallx = crossx[falling] - 1
+
+    return risex, fallx
+
+
 def _rsp_findpeaks_outliers(rsp_cleaned, extrema, amplitude_min=0.3):
+    # Extrema can only be compared if they have at least one neighbor.
+    if len(extrema) < 2:
+        return extrema[:0], rsp_cleaned[extrema[:0]]
 
     # Only consider those extrema that have a minimum vertical distance to
     # their direct neighbor, i.e., define outliers in absolute amplitude
     # difference between neighboring extrema.
-    vertical_diff = np.abs(np.diff(rsp_cleaned[extrema]))
-    median_diff = np.median(vertical_diff)
+    amplitudes = rsp_cleaned[extrema]
+    vertical_diff = np.abs(np.diff(amplitudes))
+    # The median is selected with a single partial sort (of both middle values if needed)
+    k = vertical_diff.size // 2
+    if vertical_diff.size % 2:
+        median_diff = np.partition(vertical_diff, k)[k]
+    else:
+        middle = np.partition(vertical_diff, (k - 1, k))
+        median_diff = 0.5 * (middle[k - 1] + middle[k])
     min_diff = np.where(vertical_diff > (median_diff * amplitude_min))[0]
     extrema = extrema[min_diff]
+    amplitudes = amplitudes[min_diff]
 
     # Make sure that the alternation of peaks and troughs is unbroken. If
     # alternation of sign in extdiffs is broken, remove the extrema that
     # cause the breaks.
-    amplitudes = rsp_cleaned[extrema]
-    extdiffs = np.sign(np.diff(amplitudes))
-    extdiffs = np.add(extdiffs[0:-1], extdiffs[1:])
-    removeext = np.where(extdiffs != 0)[0] + 1
-    extrema = np.delete(extrema, removeext)
-    amplitudes = np.delete(amplitudes, removeext)
+    diffs = np.diff(amplitudes)
+    extdiffs = (diffs > 0).astype(np.int8) - (diffs < 0).astype(np.int8)
+    removeext = np.flatnonzero(extdiffs[0:-1] + extdiffs[1:]) + 1
+    keep = np.ones(extrema.size, dtype=bool)
+    keep[removeext] = False
+    extrema = extrema[keep]
+    amplitudes = amplitudes[keep]
 
     return extrema, amplitudes
 
@@ -243,10 +494,11 @@ def _rsp_findpeaks_sanitize(extrema, amplitudes):
     # breathing amplitude will be defined as vertical distance between each
     # peak and the preceding trough. Note that this also ensures that the
     # number of peaks and troughs is equal.
-    if amplitudes[0] > amplitudes[1]:
-        extrema = np.delete(extrema, 0)
-    if amplitudes[-1] < amplitudes[-2]:
-        extrema = np.delete(extrema, -1)
+    if len(extrema) < 2:
+        return extrema[:0], extrema[:0]
+    first = 1 if amplitudes[0] > amplitudes[1] else 0
+    last = -1 if amplitudes[-1] < amplitudes[-2] else None
+    extrema = extrema[first:last]
     peaks = extrema[1::2]
     troughs = extrema[0:-1:2]
 
@@ -9,6 +9,13 @@ import pandas as pd
 import pytest
 
 import neurokit2 as nk
+from neurokit2.rsp.rsp_findpeaks import (
+    _rsp_findpeaks_extrema,
+    _rsp_findpeaks_extrema_loop,
+    _rsp_findpeaks_extrema_reduceat,
+    _rsp_findpeaks_extrema_views,
+    _rsp_findpeaks_zerocrossings,
+)
 
 random.seed(a=13, version=2)
 
@@ -179,6 +186,144 @@ def test_rsp_peaks():
         assert info["RSP_Peaks"][-1] > info["RSP_Troughs"][-1]
 
 
+def test_rsp_findpeaks_zerocrossings():
+    def expected(signal):
+        sign_changes = np.diff(np.signbit(signal).view(np.int8))
+        return np.flatnonzero(sign_changes == -1), np.flatnonzero(sign_changes == 1)
+
+    def check(signal):
+        risex, fallx = _rsp_findpeaks_zerocrossings(signal)
+        expected_risex, expected_fallx = expected(signal)
+        assert np.array_equal(risex, expected_risex)
+        assert np.array_equal(fallx, expected_fallx)
+
+    # Random signs, with exact zeros and negative zeros (counted as negative), for lengths around
+    # the 64-sample word size
+    rng = np.random.default_rng(42)
+    for n in [0, 1, 2, 3, 63, 64, 65, 127, 128, 129, 191, 1000, 3001]:
+        for _ in range(5):
+            signal = rng.choice([-1.5, -0.0, 0.0, 2.0], size=n)
+            check(signal)
+            check(signal.astype(np.float32))
+            if n > 0:
+                signal[-1] = -1.0
+                check(signal)
+
+    # Crossings on the first and last bits of words, including between words
+    for x in [0, 1, 62, 63, 64, 65, 126, 127]:
+        for n in [x + 1, x + 2, 128, 129]:
+            signal = np.ones(n)
+            signal[x:] = -1
+            check(signal)
+            check(-signal)
+
+
+def test_rsp_findpeaks_extrema():
+    rsp = nk.rsp_simulate(duration=60, sampling_rate=250, respiratory_rate=15, random_state=42)
+    rsp_cleaned = nk.rsp_clean(rsp, sampling_rate=250)
+    extrema = _rsp_findpeaks_extrema(rsp_cleaned)
+
+    # Compare against the (uncompiled) segment scan
+    risex = np.where((rsp_cleaned[:-1] < 0) & (rsp_cleaned[1:] >= 0))[0]
+    fallx = np.where((rsp_cleaned[:-1] >= 0) & (rsp_cleaned[1:] < 0))[0]
+    allx = np.sort(np.concatenate((risex, fallx)))
+    expected = _rsp_findpeaks_extrema_loop(rsp_cleaned, allx, risex[0] < fallx[0])
+    assert np.array_equal(extrema, expected)
+    reduced = _rsp_findpeaks_extrema_reduceat(rsp_cleaned, allx, risex[0] < fallx[0])
+    assert np.array_equal(reduced, expected)
+    views = _rsp_findpeaks_extrema_views(rsp_cleaned, allx, risex[0] < fallx[0])
+    assert np.array_equal(views, expected)
+
+    # Segments containing NaNs return their first NaN (as np.argmax() does), including when it
+    # starts the segment or is in the last one
+    rsp_nan = rsp_cleaned.copy()
+    rsp_nan[[allx[1] + 5, allx[1] + 9, allx[3], allx[-1] - 1]] = np.nan
+    expected = _rsp_findpeaks_extrema_views(rsp_nan, allx, risex[0] < fallx[0])
+    assert expected[1] == allx[1] + 5 and expected[3] == allx[3] and expected[-1] == allx[-1] - 1
+    for extrema_loop in [_rsp_findpeaks_extrema_loop, _rsp_findpeaks_extrema_reduceat]:
+        assert np.array_equal(extrema_loop(rsp_nan, allx, risex[0] < fallx[0]), expected)
+    assert len(_rsp_findpeaks_extrema(rsp_nan)) > 0
+    assert len(extrema) == len(allx) - 1
+
+
+def test_rsp_findpeaks_cache():
+    rsp = nk.rsp_simulate(duration=60, sampling_rate=250, respiratory_rate=15, random_state=42)
+    rsp_cleaned = nk.rsp_clean(rsp, sampling_rate=250)
+    info1 = nk.rsp_findpeaks(rsp_cleaned, sampling_rate=250, cache=True)
+    peaks = info1["RSP_Peaks"].copy()
+
+    # Modifying the returned arrays should not affect subsequent calls
+    info1["RSP_Peaks"][:] = 0
+    info2 = nk.rsp_findpeaks(rsp_cleaned, sampling_rate=250, cache=True)
+    assert np.array_equal(info2["RSP_Peaks"], peaks)
+    assert info2 is not info1
+    assert np.array_equal(nk.rsp_findpeaks(rsp_cleaned, sampling_rate=250)["RSP_Peaks"], peaks)
+
+    # Unhashable parameters are not cached
+    info = nk.rsp_findpeaks(
+        rsp_cleaned, sampling_rate=250, method="scipy", peak_prominence=[0.5, None], cache=True
+    )
+    assert len(info["RSP_Peaks"]) > 0
+
+
+def test_rsp_findpeaks_dataframe():
+    rsp = nk.rsp_simulate(duration=60, sampling_rate=250, respiratory_rate=15, random_state=42)
+    rsp_cleaned = nk.rsp_clean(rsp, sampling_rate=250)
+    info = nk.rsp_findpeaks(rsp_cleaned, sampling_rate=250)
+
+    # Falls back on the other RSP columns
+    info_df = nk.rsp_findpeaks(pd.DataFrame({"RSP_Raw": rsp_cleaned}), sampling_rate=250)
+    assert np.array_equal(info_df["RSP_Peaks"], info["RSP_Peaks"])
+
+    with pytest.raises(KeyError, match="RSP_Clean"):
+        nk.rsp_findpeaks(pd.DataFrame({"ECG": rsp_cleaned}), sampling_rate=250)
+
+
+def test_rsp_findpeaks_float32():
+    rsp = nk.rsp_simulate(duration=60, sampling_rate=250, respiratory_rate=15, random_state=42)
+    rsp_cleaned = nk.rsp_clean(rsp, sampling_rate=250)
+    for method in ["khodadad2018", "biosppy", "scipy"]:
+        info64 = nk.rsp_findpeaks(rsp_cleaned, sampling_rate=250, method=method)
+        info32 = nk.rsp_findpeaks(rsp_cleaned.astype(np.float32), sampling_rate=250, method=method)
+        # Rounding can only move extrema along flat segments
+        for key in ["RSP_Peaks", "RSP_Troughs"]:
+            assert len(info32[key]) == len(info64[key])
+            assert np.all(np.abs(info32[key] - info64[key]) <= 1)
+
+
+def test_rsp_findpeaks_batch():
+    rsp1 = nk.rsp_simulate(duration=60, sampling_rate=250, respiratory_rate=15, random_state=1)
+    rsp2 = nk.rsp_simulate(duration=60, sampling_rate=250, respiratory_rate=20, random_state=2)
+    cleaned = np.vstack(
+        [nk.rsp_clean(rsp1, sampling_rate=250), nk.rsp_clean(rsp2, sampling_rate=250)]
+    )
+
+    infos = nk.rsp_findpeaks_batch(cleaned, sampling_rate=250)
+    assert len(infos) == 2
+    for i, info in enumerate(infos):
+        expected = nk.rsp_findpeaks(cleaned[i], sampling_rate=250)
+        assert np.array_equal(info["RSP_Peaks"], expected["RSP_Peaks"])
+        assert np.array_equal(info["RSP_Troughs"], expected["RSP_Troughs"])
+
+    # Channels as DataFrame columns
+    infos_df = nk.rsp_findpeaks_batch(pd.DataFrame(cleaned.T), sampling_rate=250)
+    assert np.array_equal(infos_df[1]["RSP_Peaks"], infos[1]["RSP_Peaks"])
+
+    # Non-numeric columns (e.g., labels) are not taken as channels
+    signals = pd.DataFrame({"RSP_1": cleaned[0], "Label": "rest"})
+    with pytest.raises(ValueError, match="Label"):
+        nk.rsp_findpeaks_batch(signals, sampling_rate=250)
+
+
+def test_rsp_findpeaks_flat():
+    # Signals without zero crossings (flat or DC-offset) have no extrema
+    for signal in [np.zeros(5000), np.ones(5000)]:
+        for method in ["khodadad2018", "biosppy", "scipy"]:
+            info = nk.rsp_findpeaks(signal, sampling_rate=250, method=method)
+            assert len(info["RSP_Peaks"]) == 0
+            assert len(info["RSP_Troughs"]) == 0
+
+
 def test_rsp_amplitude():
     rsp = nk.rsp_simulate(
         duration=120,